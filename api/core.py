@@ -0,0 +1,533 @@
+import asyncio
+import logging
+import re
+import httpx
+import orjson
+from cachetools import TTLCache
+from quart import Quart, request, Response
+from quart_cors import cors  # Added for CORS support
+from openai import AsyncOpenAI
+import numpy as np
+import os
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"), format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Load environment variables from .env file
+load_dotenv()
+
+OPENAI_KEY = os.getenv("OPENAI_API_KEY")
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+logging.info("Loaded environment variables.")
+
+# orjson-backed response helper: one fast serialization pass instead of
+# jsonify's stdlib json plus re-encode
+def ojson(payload, status=200):
+    return Response(orjson.dumps(payload), status=status, mimetype="application/json")
+
+# Per-field patterns over the partial JSON buffer, so each field can be
+# surfaced over SSE as soon as its value closes mid-stream
+JSON_FIELD_RES = {
+    "song": re.compile(r'"song"\s*:\s*"([^"]*)"'),
+    "artist": re.compile(r'"artist"\s*:\s*"([^"]*)"'),
+    "lighting": re.compile(r'"lighting"\s*:\s*"([^"]*)"'),
+}
+
+# Format one SSE event
+def sse_event(name, payload):
+    return f"event: {name}\ndata: {orjson.dumps(payload).decode()}\n\n"
+
+# Wrap an async iterator of (name, payload) events as an SSE response
+def sse_response(events):
+    async def gen():
+        async for name, payload in events:
+            yield sse_event(name, payload)
+    return Response(gen(), mimetype="text/event-stream")
+
+# Replay an already-computed recommendation as events (cache and
+# coalesced hits deliver everything at once)
+async def replay_events(payload):
+    for name in ("song", "artist", "lighting"):
+        if name in payload:
+            yield name, {name: payload[name]}
+    yield "result", payload
+
+
+# Shared HTTP client: one connection pool for both providers, so TLS
+# handshakes amortize across requests and HTTP/2 multiplexes in-flight calls
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+    http2=True,
+    timeout=30.0
+)
+logging.info("Shared HTTP client initialized.")
+
+# OpenAI setup (for /sensor)
+openai_client = AsyncOpenAI(api_key=OPENAI_KEY, http_client=http_client)
+logging.info("Async OpenAI client initialized.")
+
+# Groq setup (for /spotify)
+groq_client = AsyncOpenAI(
+    api_key=GROQ_API_KEY,
+    base_url="https://api.groq.com/openai/v1",
+    http_client=http_client
+)
+logging.info("Async Groq client initialized for Spotify endpoint.")
+
+# TTL cache for recommendations: mood is one of four labels and pulse is
+# bucketed, so repeated inputs skip the LLM round-trip entirely
+recommendation_cache = TTLCache(maxsize=512, ttl=60)
+cache_lock = asyncio.Lock()
+# In-flight coalescing map: the first request for a key owns the LLM call,
+# concurrent requests for the same key await its future instead
+inflight = {}
+logging.info("Recommendation TTL cache initialized.")
+
+# Store recent pulse rate averages (last 3 intervals, ~45 seconds) in a
+# fixed-size ring buffer; nothing reads per-entry timestamps, so only the
+# pulses are kept
+HISTORY_SIZE = 3
+pulse_ring = np.zeros(HISTORY_SIZE, np.float32)
+ring_head = 0
+ring_count = 0
+history_lock = asyncio.Lock()
+logging.info("Pulse history ring buffers initialized.")
+
+# Record a pulse reading in the ring buffer
+def record_pulse(pulse):
+    global ring_head, ring_count
+    pulse_ring[ring_head] = pulse
+    ring_head = (ring_head + 1) % HISTORY_SIZE
+    ring_count = min(ring_count + 1, HISTORY_SIZE)
+
+# Return recorded pulses as floats, oldest first
+def recent_pulses():
+    start = (ring_head - ring_count) % HISTORY_SIZE
+    return [float(pulse_ring[(start + i) % HISTORY_SIZE]) for i in range(ring_count)]
+
+# Static system prompts, kept byte-identical across requests so providers
+# that cache shared prompt prefixes can reuse them
+SENSOR_SYSTEM_PROMPT = "You are a DJ agent that recommends songs, artists, and lighting colors based on crowd mood. Respond ONLY with JSON in the format: {\"song\": <song>, \"artist\": <artist>, \"lighting\": <color>}"
+DJ_TICK_SYSTEM_PROMPT = "You are a DJ agent that recommends songs, artists, lighting colors and Spotify queue updates based on crowd mood. Respond ONLY with JSON in the format: {\"song\": <song>, \"artist\": <artist>, \"lighting\": <color>, \"queue_add\": {\"song\": <song>, \"artist\": <artist>}}"
+SPOTIFY_SYSTEM_PROMPT = "You are a DJ agent that recommends songs and artists to update a Spotify queue based on mood and playback. Respond ONLY with JSON in the format: {\"song\": <song>, \"artist\": <artist>}"
+
+# Frozen message dicts and user templates: per-request message building is
+# two %-substitutions instead of re-interpolating identical strings
+SENSOR_SYSTEM_MSG = {"role": "system", "content": SENSOR_SYSTEM_PROMPT}
+DJ_TICK_SYSTEM_MSG = {"role": "system", "content": DJ_TICK_SYSTEM_PROMPT}
+SPOTIFY_SYSTEM_MSG = {"role": "system", "content": SPOTIFY_SYSTEM_PROMPT}
+SENSOR_USER_TMPL = "mood=%s pulse=%.0f hist=%s"
+QUEUE_USER_TMPL = "mood=%s pulse=%.0f hist=%s now_playing=%s by %s queue=%s"
+
+# Fixed-width digest of the pulse history: one decimal-free value per entry,
+# far fewer prompt tokens than the list repr
+def pulse_digest(pulses):
+    return ",".join(f"{p:.0f}" for p in pulses)
+
+# Mood lookup table indexed by (pulse bucket, trend index): buckets are
+# <80, 80-100, >100 BPM and trend is falling/stable/rising. Codes map to
+# MOODS so the kernel stays purely numeric and Numba-compilable.
+MOODS = ("chill", "festive", "hyped", "excited")
+MOOD_CODES = np.array((
+    (0, 0, 2),  # pulse < 80
+    (1, 1, 1),  # 80 <= pulse <= 100
+    (2, 3, 3),  # pulse > 100
+), dtype=np.int8)
+
+# Numeric mood kernel: scalar arithmetic plus one table load
+def infer_mood_code(pulse, prev):
+    trend_idx = (pulse > prev) - (pulse < prev) + 1
+    pulse_bucket = (pulse >= 80.0) + (pulse > 100.0)
+    return MOOD_CODES[pulse_bucket, trend_idx]
+
+# Compile the kernel to native code when Numba is available; the warm-up
+# call loads the cached machine code before the first request arrives
+try:
+    from numba import njit
+    infer_mood_code = njit(cache=True)(infer_mood_code)
+    infer_mood_code(80.0, 80.0)
+    logging.info("Mood kernel compiled with Numba.")
+except ImportError:
+    logging.info("Numba not installed; mood kernel runs as plain Python.")
+
+# Determine mood based on pulse rate and trend
+def infer_mood(pulse, history):
+    logging.debug("Inferring mood for pulse: %s, history: %s", pulse, history)
+    prev = history[-2] if len(history) >= 2 else pulse
+    return MOODS[int(infer_mood_code(float(pulse), float(prev)))]
+
+async def index():
+    logging.info("Index route accessed.")
+    return "Welcome to the DJ Agent API!"
+
+# API to receive sensor data (pulse rate). Responds as SSE by default so
+# clients can act on each field at first token; ?stream=false returns the
+# legacy JSON blob.
+async def process_sensor():
+    try:
+        want_stream = request.args.get('stream', 'true').lower() != 'false'
+        data = orjson.loads(await request.get_data())
+        logging.debug("Received sensor data: %s", data)
+        pulse = float(data.get('pulse', 80))  # Average pulse rate
+
+        # Update pulse history; the lock keeps the append and the snapshot
+        # consistent when requests overlap
+        async with history_lock:
+            record_pulse(pulse)
+            pulses = recent_pulses()
+        logging.info("Updated pulse history: %s", pulses)
+
+        # Infer mood
+        mood = infer_mood(pulse, pulses)
+        logging.info("Inferred mood: %s", mood)
+
+        # Check the cache before paying for an LLM round-trip
+        cache_key = ("sensor", mood, int(pulse) // 5)
+        async with cache_lock:
+            cached = recommendation_cache.get(cache_key)
+        if cached is not None:
+            song, artist, color = cached
+            logging.info("Cache hit for %s: %s by %s, %s", cache_key, song, artist, color)
+            payload = {
+                "mood": mood,
+                "song": song,
+                "artist": artist,
+                "lighting": color,
+                "status": "success"
+            }
+            if want_stream:
+                return sse_response(replay_events(payload))
+            return ojson(payload)
+
+        # Coalesce concurrent identical requests into one upstream call
+        fut = inflight.get(cache_key)
+        if fut is not None:
+            logging.info("Joining in-flight request for %s", cache_key)
+            result = await fut
+            if result is None:
+                raise RuntimeError(f"in-flight request for {cache_key} failed")
+            song, artist, color = result
+            payload = {
+                "mood": mood,
+                "song": song,
+                "artist": artist,
+                "lighting": color,
+                "status": "success"
+            }
+            if want_stream:
+                return sse_response(replay_events(payload))
+            return ojson(payload)
+
+        fut = asyncio.get_running_loop().create_future()
+        inflight[cache_key] = fut
+
+        # LLM: Recommend song, artist, and lighting (using OpenAI). Each
+        # field is emitted as soon as its value closes in the buffered JSON,
+        # and the stream stops once the whole object parses.
+        async def recommendation_events():
+            try:
+                prompt = SENSOR_USER_TMPL % (mood, pulse, pulse_digest(pulses))
+                logging.debug("Generated prompt for OpenAI: %s", prompt)
+                stream = await openai_client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=[
+                        SENSOR_SYSTEM_MSG,
+                        {"role": "user", "content": prompt}
+                    ],
+                    response_format={"type": "json_object"},
+                    max_tokens=40,
+                    temperature=0.7,
+                    stream=True
+                )
+
+                recommendation = ""
+                parsed = None
+                emitted = set()
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    recommendation += delta
+                    for name in ("song", "artist", "lighting"):
+                        if name not in emitted:
+                            m = JSON_FIELD_RES[name].search(recommendation)
+                            if m:
+                                emitted.add(name)
+                                yield name, {name: m.group(1)}
+                    if recommendation.rstrip().endswith("}"):
+                        try:
+                            parsed = orjson.loads(recommendation)
+                        except orjson.JSONDecodeError:
+                            continue
+                        await stream.close()
+                        break
+                logging.debug("Streamed OpenAI recommendation: %s", recommendation)
+
+                parsed = parsed or {}
+                song = parsed.get("song") or "Sweet but Psycho"
+                artist = parsed.get("artist") or "Ava Max"
+                color = parsed.get("lighting") or "red"
+                logging.debug("Parsed recommendation - Song: %s, Artist: %s, Lighting: %s", song, artist, color)
+
+                async with cache_lock:
+                    recommendation_cache[cache_key] = (song, artist, color)
+                fut.set_result((song, artist, color))
+                yield "result", {
+                    "mood": mood,
+                    "song": song,
+                    "artist": artist,
+                    "lighting": color,
+                    "status": "success"
+                }
+            finally:
+                inflight.pop(cache_key, None)
+                if not fut.done():
+                    fut.set_result(None)  # wake waiters so they can error out
+
+        if want_stream:
+            return sse_response(recommendation_events())
+
+        # Legacy blob: drain the events and return the final result
+        payload = None
+        async for name, event_payload in recommendation_events():
+            if name == "result":
+                payload = event_payload
+        if payload is None:
+            raise RuntimeError("recommendation stream ended without a result")
+        return ojson(payload)
+    except Exception as e:
+        logging.error("Error in /sensor route: %s", e)
+        return ojson({"status": "error", "message": str(e)}, 500)
+
+# API to handle a full DJ tick: fuses the /sensor and /spotify calls into a
+# single LLM request so a session pays one round-trip per tick instead of two
+async def process_dj_tick():
+    try:
+        data = orjson.loads(await request.get_data())
+        logging.debug("Received DJ tick data: %s", data)
+        pulse = float(data.get('pulse', 80))  # Average pulse rate
+        current_song = data.get('current_song', "Unknown")
+        current_artist = data.get('current_artist', "Unknown")
+        queue = data.get('queue', [])  # List of {"song": str, "artist": str}
+
+        # Update pulse history; the lock keeps the append and the snapshot
+        # consistent when requests overlap
+        async with history_lock:
+            record_pulse(pulse)
+            pulses = recent_pulses()
+        logging.info("Updated pulse history: %s", pulses)
+
+        # Infer mood
+        mood = infer_mood(pulse, pulses)
+        logging.info("Inferred mood: %s", mood)
+
+        # Check the cache before paying for an LLM round-trip
+        cache_key = (
+            "dj_tick", mood, int(pulse) // 5, current_song, current_artist,
+            tuple((item['song'], item['artist']) for item in queue)
+        )
+        async with cache_lock:
+            cached = recommendation_cache.get(cache_key)
+        if cached is not None:
+            logging.info("Cache hit for %s", cache_key)
+            return ojson(dict(cached, mood=mood, status="success"))
+
+        # Coalesce concurrent identical requests into one upstream call
+        fut = inflight.get(cache_key)
+        if fut is not None:
+            logging.info("Joining in-flight request for %s", cache_key)
+            result = await fut
+            if result is None:
+                raise RuntimeError(f"in-flight request for {cache_key} failed")
+            return ojson(dict(result, mood=mood, status="success"))
+
+        fut = asyncio.get_running_loop().create_future()
+        inflight[cache_key] = fut
+        try:
+            # LLM: Recommend the floor track, lighting and queue update in one call
+            queue_str = ", ".join("%s by %s" % (item['song'], item['artist']) for item in queue)
+            prompt = QUEUE_USER_TMPL % (
+                mood, pulse, pulse_digest(pulses),
+                current_song, current_artist, queue_str if queue_str else 'empty'
+            )
+            logging.debug("Generated prompt for OpenAI: %s", prompt)
+            response = await openai_client.chat.completions.create(
+                model="gpt-4o",
+                messages=[
+                    DJ_TICK_SYSTEM_MSG,
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={"type": "json_object"},
+                max_tokens=80,
+                temperature=0.7
+            )
+            recommendation = orjson.loads(response.choices[0].message.content)
+            logging.debug("Parsed OpenAI recommendation: %s", recommendation)
+
+            result = {
+                "song": recommendation.get("song", "Sweet but Psycho"),
+                "artist": recommendation.get("artist", "Ava Max"),
+                "lighting": recommendation.get("lighting", "red"),
+                "queue_add": recommendation.get("queue_add", {"song": "Uptown Funk", "artist": "Mark Ronson"})
+            }
+
+            async with cache_lock:
+                recommendation_cache[cache_key] = result
+            fut.set_result(result)
+        finally:
+            inflight.pop(cache_key, None)
+            if not fut.done():
+                fut.set_result(None)  # wake waiters so they can error out
+
+        return ojson(dict(result, mood=mood, status="success"))
+    except Exception as e:
+        logging.error("Error in /dj_tick route: %s", e)
+        return ojson({"status": "error", "message": str(e)}, 500)
+
+# API to communicate with Spotify server (using Groq). Responds as SSE by
+# default like /sensor; ?stream=false returns the legacy JSON blob.
+async def process_spotify():
+    try:
+        want_stream = request.args.get('stream', 'true').lower() != 'false'
+        data = orjson.loads(await request.get_data())
+        logging.debug("Received Spotify data: %s", data)
+        current_song = data.get('current_song', "Unknown")
+        current_artist = data.get('current_artist', "Unknown")
+        queue = data.get('queue', [])  # List of {"song": str, "artist": str}
+
+        # Get latest pulse rate and mood
+        async with history_lock:
+            pulses = recent_pulses()
+        latest_pulse = pulses[-1] if pulses else 80
+        mood = infer_mood(latest_pulse, pulses)
+        logging.info("Latest pulse: %s, inferred mood: %s", latest_pulse, mood)
+
+        # Check the cache before paying for an LLM round-trip
+        cache_key = (
+            "spotify", mood, current_song, current_artist,
+            tuple((item['song'], item['artist']) for item in queue)
+        )
+        async with cache_lock:
+            cached = recommendation_cache.get(cache_key)
+        if cached is not None:
+            song, artist = cached
+            logging.info("Cache hit for %s: %s by %s", cache_key, song, artist)
+            payload = {
+                "song": song,
+                "artist": artist,
+                "status": "success"
+            }
+            if want_stream:
+                return sse_response(replay_events(payload))
+            return ojson(payload)
+
+        # Coalesce concurrent identical requests into one upstream call
+        fut = inflight.get(cache_key)
+        if fut is not None:
+            logging.info("Joining in-flight request for %s", cache_key)
+            result = await fut
+            if result is None:
+                raise RuntimeError(f"in-flight request for {cache_key} failed")
+            song, artist = result
+            payload = {
+                "song": song,
+                "artist": artist,
+                "status": "success"
+            }
+            if want_stream:
+                return sse_response(replay_events(payload))
+            return ojson(payload)
+
+        fut = asyncio.get_running_loop().create_future()
+        inflight[cache_key] = fut
+
+        # LLM: Recommend song/artist to update queue (using Groq). Fields are
+        # emitted as they close in the buffered JSON, then a final result.
+        async def recommendation_events():
+            try:
+                queue_str = ", ".join("%s by %s" % (item['song'], item['artist']) for item in queue)
+                prompt = QUEUE_USER_TMPL % (
+                    mood, latest_pulse, pulse_digest(pulses),
+                    current_song, current_artist, queue_str if queue_str else 'empty'
+                )
+                logging.debug("Generated prompt for Groq: %s", prompt)
+                stream = await groq_client.chat.completions.create(
+                    model="llama3-70b-8192",  # Groq model
+                    messages=[
+                        SPOTIFY_SYSTEM_MSG,
+                        {"role": "user", "content": prompt}
+                    ],
+                    response_format={"type": "json_object"},
+                    max_tokens=40,
+                    temperature=0.7,
+                    stream=True
+                )
+
+                recommendation = ""
+                parsed = None
+                emitted = set()
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    recommendation += delta
+                    for name in ("song", "artist"):
+                        if name not in emitted:
+                            m = JSON_FIELD_RES[name].search(recommendation)
+                            if m:
+                                emitted.add(name)
+                                yield name, {name: m.group(1)}
+                    if recommendation.rstrip().endswith("}"):
+                        try:
+                            parsed = orjson.loads(recommendation)
+                        except orjson.JSONDecodeError:
+                            continue
+                        await stream.close()
+                        break
+                logging.debug("Streamed Groq recommendation: %s", recommendation)
+
+                parsed = parsed or {}
+                song = parsed.get("song") or "Uptown Funk"
+                artist = parsed.get("artist") or "Mark Ronson"
+                logging.debug("Parsed recommendation - Song: %s, Artist: %s", song, artist)
+
+                async with cache_lock:
+                    recommendation_cache[cache_key] = (song, artist)
+                fut.set_result((song, artist))
+                yield "result", {
+                    "song": song,
+                    "artist": artist,
+                    "status": "success"
+                }
+            finally:
+                inflight.pop(cache_key, None)
+                if not fut.done():
+                    fut.set_result(None)  # wake waiters so they can error out
+
+        if want_stream:
+            return sse_response(recommendation_events())
+
+        # Legacy blob: drain the events and return the final result
+        payload = None
+        async for name, event_payload in recommendation_events():
+            if name == "result":
+                payload = event_payload
+        if payload is None:
+            raise RuntimeError("recommendation stream ended without a result")
+        return ojson(payload)
+    except Exception as e:
+        logging.error("Error in /spotify route: %s", e)
+        return ojson({"status": "error", "message": str(e)}, 500)
+
+# Build the Quart app and register routes (ASGI, so LLM calls await
+# instead of blocking the worker)
+def make_app():
+    app = Quart(__name__)
+    app = cors(app)  # Enable CORS for all routes
+    app.add_url_rule('/', 'index', index)
+    app.add_url_rule('/sensor', 'process_sensor', process_sensor, methods=['POST'])
+    app.add_url_rule('/dj_tick', 'process_dj_tick', process_dj_tick, methods=['POST'])
+    app.add_url_rule('/spotify', 'process_spotify', process_spotify, methods=['POST'])
+    logging.info("Quart app created with CORS enabled.")
+    return app